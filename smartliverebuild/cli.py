@@ -192,28 +192,24 @@ def main(argv):
         try:
             import psutil
 
-            def getproc(pid):
-                for ps in psutil.get_process_list():
-                    if pid == ps.pid:
-                        return ps
-                raise Exception()
-
             def getscriptname(ps):
-                if os.path.basename(ps.cmdline[0]) != ps.name:
-                    return ps.cmdline[0]
-                cmdline = ps.cmdline[1:]
+                # grab both in one go to avoid rereading /proc
+                info = ps.as_dict(["name", "cmdline"])
+                if os.path.basename(info["cmdline"][0]) != info["name"]:
+                    return info["cmdline"][0]
+                cmdline = info["cmdline"][1:]
                 while cmdline[0].startswith("-"):  # omit options
                     cmdline.pop(0)
                 return os.path.basename(cmdline[0])
 
-            ps = getproc(os.getppid())
+            ps = psutil.Process(os.getppid())
             # traverse upstream to find the emerge process
             while ps.pid > 1:
                 if getscriptname(ps) == "emerge":
                     out.s1("Running under the emerge process, assuming --pretend.")
                     opts.pretend = True
                     break
-                ps = ps.parent
+                ps = ps.parent()
         except Exception:
             pass
 
@@ -2,8 +2,11 @@
 # (c) 2011 Michał Górny <mgorny@gentoo.org>
 # Released under the terms of the 2-clause BSD license.
 
-import os, os.path, pickle, signal, subprocess, sys, time
+import collections, marshal, os, os.path, selectors, signal, struct, subprocess
+import sys, time
+from concurrent.futures import ThreadPoolExecutor
 
+from .environ import EnvironmentParser, environ_path, read_environ, read_inherited
 from .filtering import PackageFilter
 from .output import out
 from .vcs import NonLiveEbuild, OtherEclass
@@ -14,6 +17,41 @@ class SLRFailure(Exception):
     pass
 
 
+def wait_for_updates(processes, timeout=0):
+    """Block until any of the running update `processes' terminates.
+
+    If `timeout' is non-zero, wake up when the earliest started process
+    exceeds it. Uses pidfds when supported, and falls back to sleeping
+    for a short while otherwise.
+    """
+
+    running = [vcs for vcs in processes if vcs.running]
+    if not running:
+        return
+
+    if timeout:
+        timeout = min(vcs.starttime for vcs in running) + float(timeout)
+        timeout = max(0, timeout - time.time())
+    else:
+        timeout = None
+
+    sel = selectors.DefaultSelector()
+    try:
+        for vcs in running:
+            try:
+                pidfd = os.pidfd_open(vcs.subprocess.pid)
+            except (AttributeError, OSError):
+                # no pidfd support, fall back to polling
+                time.sleep(0.3 if timeout is None else min(timeout, 0.3))
+                return
+            sel.register(pidfd, selectors.EVENT_READ)
+        sel.select(timeout)
+    finally:
+        for key in list(sel.get_map().values()):
+            os.close(key.fd)
+        sel.close()
+
+
 def SmartLiveRebuild(opts, pm, cliargs=None):
     if not opts.color:
         out.monochromize()
@@ -111,31 +149,76 @@ option.
                         )
                         erraneous.append(vcs.cpv)
                         del processes[i]
-                        cache[str(vcs)] = e
+                        cache[vcs.cachekey] = e
                 return needsleep
 
             filters = (opts.filter_packages or []) + (cliargs or [])
             filt = PackageFilter(filters)
-            getvcs = VCSLoader(remote_only=opts.remote_only)
+            vcs_by_inherit = VCSLoader(remote_only=opts.remote_only).load_all(allowed)
+            vcs_inherits = frozenset(vcs_by_inherit)
 
+            def enum_failed(pkg, e):
+                out.err(
+                    "Error enumerating %s: [%s] %s" % (pkg, e.__class__.__name__, e)
+                )
+                erraneous.append(str(pkg.slotted_atom))
+
+            envparser = EnvironmentParser()
+            # reading vdb is I/O-bound and decompressing environment files
+            # is CPU-bound, so do both in parallel
+            executor = ThreadPoolExecutor(max_workers=os.cpu_count())
             try:
-                for pkg in pm.installed.filter(filt):
+                pkgs = list(pm.installed.filter(filt))
+                # read INHERITED straight from vdb, in parallel
+                inheriteds = executor.map(read_inherited, [pkg.path for pkg in pkgs])
+
+                queue = collections.deque()
+                for pkg, inherited in zip(pkgs, inheriteds):
+                    try:
+                        if inherited is None:
+                            inherited = pkg.inherits
+                        # reject non-live packages before touching the env
+                        inherits = vcs_inherits.intersection(inherited)
+                        if not inherits:
+                            continue
+
+                        vcscls = [vcs_by_inherit[vcs] for vcs in inherits]
+
+                        envpath = environ_path(pkg)
+                        if envpath is None:
+                            raise Exception("No environment file found")
+                        queue.append(
+                            (pkg, vcscls, executor.submit(read_environ, envpath))
+                        )
+                    except KeyboardInterrupt:
+                        raise
+                    except Exception as e:
+                        if opts.debug:
+                            raise
+                        enum_failed(pkg, e)
+
+                while queue:
+                    pkg, vcscls, envdata = queue.popleft()
                     try:
-                        for vcs in pkg.inherits:
-                            vcscl = getvcs(vcs, allowed)
-                            if vcscl is not None:
-                                try:
-                                    vcs = vcscl(
-                                        str(pkg.slotted_atom),
-                                        environ=pkg.environ,
-                                        opts=opts,
-                                        cache=cache,
-                                    )
-                                except OtherEclass:
-                                    pass
-                                else:
-                                    processes.append(vcs)
-                                    loop_iter()
+                        # grab the variables for all VCS-es in one go
+                        envvars = set()
+                        for vcscl in vcscls:
+                            envvars.update(vcscl.reqenv + vcscl.optenv)
+                        environ = envparser.copy(envdata.result(), *envvars)
+
+                        for vcscl in vcscls:
+                            try:
+                                vcs = vcscl(
+                                    str(pkg.slotted_atom),
+                                    environ=environ,
+                                    opts=opts,
+                                    cache=cache,
+                                )
+                            except OtherEclass:
+                                pass
+                            else:
+                                processes.append(vcs)
+                                loop_iter()
                     except KeyboardInterrupt:
                         raise
                     except NonLiveEbuild as e:
@@ -144,19 +227,20 @@ option.
                     except Exception as e:
                         if opts.debug:
                             raise
-                        out.err(
-                            "Error enumerating %s: [%s] %s"
-                            % (pkg, e.__class__.__name__, e)
-                        )
-                        erraneous.append(str(pkg.slotted_atom))
+                        enum_failed(pkg, e)
+                executor.shutdown()
+                envparser.close()
 
                 while processes:
                     if loop_iter((opts.jobs == 1)):
-                        time.sleep(0.3)
+                        wait_for_updates(processes[: opts.jobs], opts.timeout)
             except KeyboardInterrupt:
                 out.err("Updates interrupted, proceeding with already updated repos.")
                 for vcs in processes:
                     del vcs
+            finally:
+                executor.shutdown(cancel_futures=True)
+                envparser.close()
 
             if cliargs:
                 nm = set(filt.nonmatched)
@@ -170,8 +254,11 @@ option.
                     "erraneous": erraneous,
                     "all_count": all_count,
                 }
+                data = marshal.dumps(pdata, 4)
                 pipe = os.fdopen(commpipe[1], "wb")
-                pickle.dump(pdata, pipe, pickle.HIGHEST_PROTOCOL)
+                # prefix with length to detect truncated data
+                pipe.write(struct.pack("=I", len(data)))
+                pipe.write(data)
                 pipe.flush()
                 pipe.close()
                 os._exit(0)
@@ -181,9 +268,13 @@ option.
             sigint = signal.getsignal(signal.SIGINT)
             signal.signal(signal.SIGINT, signal.SIG_IGN)
             try:
-                pdata = pickle.load(pipe)
-            except EOFError:  # child terminated early
+                (size,) = struct.unpack("=I", pipe.read(4))
+            except struct.error:  # child terminated early
+                raise SLRFailure("")
+            data = pipe.read(size)
+            if len(data) != size:  # child terminated early
                 raise SLRFailure("")
+            pdata = marshal.loads(data)
             signal.signal(signal.SIGINT, sigint)
             packages = pdata["packages"]
             erraneous = pdata["erraneous"]
@@ -198,6 +289,10 @@ option.
     if opts.erraneous_merge and len(erraneous) > 0:
         packages.extend(erraneous)
 
+    # a package can be listed more than once, e.g. if it uses multiple
+    # VCS-es or failed after updating some of them
+    packages = sorted(set(packages))
+
     # Check portdb for matches. Drop unmatched packages.
     for p in list(packages):
         if pm.Atom(p) not in pm.stack:
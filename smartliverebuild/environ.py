@@ -0,0 +1,226 @@
+# 	vim:fileencoding=utf-8:noet
+# (c) 2022 Michał Górny <mgorny@gentoo.org>
+# Released under the terms of the 2-clause BSD license.
+
+import bz2, os, os.path, re, tempfile
+
+from gentoopm.bash.bashserver import BashServer
+from gentoopm.exceptions import InvalidBashCodeError
+
+# the statements found in environment files dumped by bash
+declare_re = re.compile(rb"declare -[-a-zA-Z]+ (\w+)")
+string_value_re = re.compile(rb'="((?:[^"\\]|\\.)*)"\n', re.S)
+other_value_re = re.compile(
+    rb"""=(?:\$'(?:[^'\\]|\\.)*'|\((?:\s*\[[^\]]*\]="(?:[^"\\]|\\.)*")*\s*\))\n""",
+    re.S,
+)
+function_re = re.compile(rb"[^\s()]+ \(\) \n\{ \n.*?^\}\n", re.S | re.M)
+escape_re = re.compile(rb'\\([$`"\\\n])')
+
+
+def read_inherited(path):
+    """Read the list of inherited eclasses from the INHERITED file
+    in vdb entry at `path' and return it as a frozenset. This avoids
+    going through the package manager's metadata layer, and can be run
+    in a worker thread.
+
+    Returns None if `path' is not a vdb entry directory; the package
+    manager needs to be asked then.
+    """
+
+    if path is None:
+        return None
+    try:
+        with open(os.path.join(path, "INHERITED")) as f:
+            return frozenset(f.read().split())
+    except FileNotFoundError:
+        # the file is not written when nothing is inherited
+        return frozenset() if os.path.isdir(path) else None
+    except OSError:
+        return None
+
+
+def parse_environ(data, varlist):
+    r"""Grab the values of variables listed in `varlist' from environment
+    `data' (bytes) without running bash. This handles the plain
+    `declare' statements and function definitions dumped by bash.
+    Returns a dict, or None if anything else is encountered and bash
+    needs to be used instead.
+
+    >>> env = (
+    ...     b'declare -x A="foo \\$bar \\"baz\\""\n'
+    ...     b'declare -a ARR=([0]="a" [1]="b")\n'
+    ...     b"declare -- B\n"
+    ...     b"f () \n{ \n    C=1\n}\n"
+    ... )
+    >>> sorted(parse_environ(env, ["A", "B", "C"]).items())
+    [('A', 'foo $bar "baz"'), ('B', ''), ('C', '')]
+    >>> parse_environ(env, ["ARR"]) is None
+    True
+    >>> parse_environ(b"A=foo\n", ["A"]) is None
+    True
+    """
+
+    wanted = frozenset(varlist)
+    ret = dict.fromkeys(varlist, "")
+    if not data.endswith(b"\n"):
+        data += b"\n"
+
+    pos = 0
+    try:
+        while pos < len(data):
+            if data[pos : pos + 1] == b"\n":
+                pos += 1
+                continue
+
+            m = declare_re.match(data, pos)
+            if m is None:
+                m = function_re.match(data, pos)
+                if m is None:
+                    return None
+                pos = m.end()
+                continue
+
+            name = m.group(1).decode("utf-8")
+            pos = m.end()
+            if data[pos : pos + 1] == b"\n":
+                # declared without a value
+                if name in wanted:
+                    ret[name] = ""
+                pos += 1
+                continue
+
+            m = string_value_re.match(data, pos)
+            if m is not None:
+                if name in wanted:
+                    ret[name] = escape_re.sub(
+                        lambda e: b"" if e.group(1) == b"\n" else e.group(1),
+                        m.group(1),
+                    ).decode("utf-8")
+                pos = m.end()
+                continue
+
+            # arrays and $'...' strings are left to bash
+            if name in wanted:
+                return None
+            m = other_value_re.match(data, pos)
+            if m is None:
+                return None
+            pos = m.end()
+    except UnicodeDecodeError:
+        return None
+
+    return ret
+
+
+def environ_path(pkg):
+    """Get the path to the environment file of installed package `pkg'.
+    Prefers the newer of environment.bz2 and environment, like gentoopm
+    does. Returns None if no environment file is available.
+    """
+
+    p = pkg.path
+    if p is None:
+        return None
+
+    if os.path.isdir(p):
+
+        def _mtime_if_exists(path):
+            try:
+                return os.path.getmtime(path)
+            except OSError:
+                return -1
+
+        files = [os.path.join(p, fn) for fn in ("environment.bz2", "environment")]
+        p = max(files, key=_mtime_if_exists)
+
+    if not os.path.exists(p):
+        return None
+    return p
+
+
+def read_environ(path):
+    """Read the environment file from `path', decompressing it
+    if necessary, and return its contents as bytes.
+
+    This function does not touch the package manager, and therefore can
+    be safely run in a worker thread (bz2 releases the GIL while
+    decompressing).
+    """
+
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith(".bz2"):
+        data = bz2.decompress(data)
+    return data
+
+
+class EnvironmentBashServer(BashServer):
+    """A BashServer loading environment from bytes. Unlike
+    BashServer.load_file(), it does not create a new temporary file
+    and copy the file object into it for every package; a single
+    temporary file is reused instead.
+    """
+
+    def __init__(self):
+        BashServer.__init__(self)
+        self._tmpf = tempfile.NamedTemporaryFile("w+b")
+
+    def terminate(self):
+        BashServer.terminate(self)
+        self._tmpf.close()
+
+    def load_data(self, data):
+        """Load and execute the environment from `data' (bytes)."""
+        f = self._tmpf
+        f.seek(0)
+        f.truncate()
+        f.write(data)
+        f.flush()
+
+        # Environment files are dumped by bash itself, so instead
+        # of checking the syntax via `bash -n' (spawning another bash
+        # for every package), just source the file in the fresh subshell
+        # and check the exit status. Syntax errors make it non-zero.
+        self._write(
+            "exit 0",
+            'source %s &>/dev/null; printf "%%d\\0" "${?}"' % repr(f.name),
+        )
+        ret = self._read1()
+        if not ret.isdigit():
+            raise AssertionError("Sourcing unexpectedly caused stdout output")
+        if ret != "0":
+            raise InvalidBashCodeError()
+
+
+class EnvironmentParser(object):
+    """A parser for environment files that were already read into
+    memory. Tries parse_environ() first, and falls back to a lazily
+    started bash process.
+    """
+
+    _parser = None
+
+    def copy(self, data, *varlist):
+        """Load the environment from `data' (bytes) and return
+        the values of variables listed in `varlist' as a dict.
+        """
+
+        ret = parse_environ(data, varlist)
+        if ret is not None:
+            return ret
+
+        if self._parser is None:
+            self._parser = EnvironmentBashServer()
+        try:
+            self._parser.load_data(data)
+        except Exception:
+            self.close()
+            raise
+        return self._parser.copy(*varlist)
+
+    def close(self):
+        """Terminate the underlying bash process (if any)."""
+        if self._parser is not None:
+            self._parser.terminate()
+            self._parser = None
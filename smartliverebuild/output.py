@@ -36,32 +36,35 @@ class SLROutput(object):
         self.s1 = lambda x: None
         self.s2 = lambda x: None
         self.s3 = lambda x: None
+        self.pkgs = lambda header, msg: None
 
     def result(self, msg):
         """Basically a s1 which doesn't respect --quiet."""
-        self.out("%s*** %s%s\n" % (self.s1reset, msg, self.reset))
+        self.out(f"{self.s1reset}*** {msg}{self.reset}\n")
 
     def s1(self, msg):
-        self.out("%s*** %s%s\n" % (self.s1reset, msg, self.reset))
+        self.out(f"{self.s1reset}*** {msg}{self.reset}\n")
         self._cur_header = None
 
     def s2(self, msg):
-        self.out("%s->%s  %s\n" % (self.s2reset, self.reset, msg))
+        self.out(f"{self.s2reset}->{self.reset}  {msg}\n")
 
     def s3(self, msg):
-        self.out("%s-->%s %s\n" % (self.s3reset, self.reset, msg))
+        self.out(f"{self.s3reset}-->{self.reset} {msg}\n")
 
     def pkgs(self, header, msg):
         if self._cur_header != header:
-            self.s2(header)
+            # output both lines in a single write
+            self.out(
+                f"{self.s2reset}->{self.reset}  {header}\n"
+                f"{self.s3reset}-->{self.reset} {msg}\n"
+            )
             self._cur_header = header
-        self.s3(msg)
+        else:
+            self.s3(msg)
 
     def err(self, msg):
-        self.out(
-            "%s!!!%s %s%s%s\n"
-            % (self.yellow, self.reset, self.errreset, msg, self.reset)
-        )
+        self.out(f"{self.yellow}!!!{self.reset} {self.errreset}{msg}{self.reset}\n")
         self._cur_header = None
 
     def out(self, msg):
@@ -2,7 +2,7 @@
 # (c) 2011-2017 Michał Górny <mgorny@gentoo.org>
 # Released under the terms of the 2-clause BSD license.
 
-import locale, os, subprocess, time
+import locale, os, shlex, subprocess, sys, time
 from gentoopm.util import ABCObject
 from abc import abstractmethod, abstractproperty
 
@@ -38,13 +38,10 @@ class BaseVCSSupport(ABCObject):
         """
         return []
 
-    @property
-    def optenv(self):
-        """A list of optional environment variables for the VCS.
-        Their values will be grabbed by __init__(); if one is unset,
-        an empty string will be used instead.
-        """
-        return []
+    # A list of optional environment variables for the VCS.
+    # Their values will be grabbed by __init__(); if one is unset,
+    # an empty string will be used instead.
+    optenv = []
 
     @property
     def callenv(self):
@@ -77,10 +74,22 @@ class BaseVCSSupport(ABCObject):
         """A package ID for update requestor."""
         return self._cpv
 
+    @property
+    def running(self):
+        """Whether the update process has been started and did not
+        finish yet. If True, the Popen() instance is available
+        as self.subprocess.
+        """
+        return self._running
+
     def __init__(self, cpv, environ, opts, cache=None):
         """Initialize the VCS class for package `cpv', storing it as
         self.cpv. Get envvars from `environ' (self.reqenv + self.optenv).
 
+        `environ' should be a mapping containing (at least) all
+        the variables listed in self.reqenv and self.optenv, preferably
+        fetched in a single PMPackageEnvironment.copy() call.
+
         `opts' should point to an ConfigValues instance.
 
         When subclassing, the __init__() function is a good place
@@ -99,7 +108,7 @@ class BaseVCSSupport(ABCObject):
         self._cpv = cpv
         self._opts = opts
         self._cache = cache
-        self.env = environ.copy(*(self.reqenv + self.optenv))
+        self.env = dict((v, environ[v]) for v in self.reqenv + self.optenv)
 
         missingvars = [v for v in self.reqenv if not self.env[v]]
         if len(missingvars) > 0:
@@ -121,10 +130,18 @@ class BaseVCSSupport(ABCObject):
     def __str__(self):
         pass
 
+    @property
+    def cachekey(self):
+        """The key identifying the repository in the update cache.
+        Packages with equal keys share a single update.
+        """
+        return str(self)
+
     @abstractproperty
     def updatecmd(self):
-        """The update command for a particular VCS as a shell
-        command string.
+        """The update command for a particular VCS, preferably
+        as an argument list. If shell features are necessary, a shell
+        command string can be returned instead.
         """
         pass
 
@@ -155,7 +172,7 @@ class BaseVCSSupport(ABCObject):
     def __call__(self, blocking=False):
         """Perform a single main loop iteration."""
         if not self._running:
-            rev = self._cache.get(str(self)) if self._cache is not None else None
+            rev = self._cache.get(self.cachekey) if self._cache is not None else None
 
             if rev is None:
                 self._startupdate()
@@ -180,23 +197,28 @@ class BaseVCSSupport(ABCObject):
 
         The spawned command is supposed to return the new revision
         on STDOUT, and any diagnostic messages on STDERR.
-        If necessary, shell output redirection (`>&2') can be used
-        to clean up STDOUT.
+
+        Argument lists are executed directly, without spawning
+        an intermediate shell; this also makes sure that .__del__()
+        terminates the actual VCS process. Strings are passed
+        to the shell.
 
         This function returns the spawned Popen() instance.
         """
 
         if self._cache is not None:
-            self._cache[str(self)] = self
+            self._cache[self.cachekey] = self
 
         cmd = self.updatecmd
+        shell = isinstance(cmd, str)
+        cmdstr = cmd if shell else shlex.join(cmd)
         if self._opts.jobs > 1:
-            out.pkgs(str(self), "%s%s%s" % (out.violet, cmd, out.reset))
+            out.pkgs(str(self), "%s%s%s" % (out.violet, cmdstr, out.reset))
         else:
-            out.pkgs(self._header, "%s%s%s" % (out.violet, cmd, out.reset))
+            out.pkgs(self._header, "%s%s%s" % (out.violet, cmdstr, out.reset))
 
         popenargs["env"] = self.callenv
-        popenargs["shell"] = True
+        popenargs["shell"] = shell
         self.subprocess = subprocess.Popen(cmd, **popenargs)
         self.starttime = time.time()
 
@@ -227,17 +249,23 @@ class BaseVCSSupport(ABCObject):
                     raise Exception("timeout occured")
                 return None
 
-        (sod, sed) = self.subprocess.communicate()
-        ret = self.subprocess.returncode
+        # only STDOUT may be piped, so read it directly
+        sod = b""
+        if self.subprocess.stdout is not None:
+            with self.subprocess.stdout as f:
+                sod = f.read()
+        ret = self.subprocess.wait()
         self._running = False
 
         if ret == 0:
-            newrev = self.parseoutput(sod.decode("ASCII") if sod else "")
+            newrev = self.parseoutput(
+                sod.decode(locale.getpreferredencoding(), "replace")
+            )
             if newrev is None:
                 raise Exception("update command failed to return a rev")
 
             if self._cache is not None:
-                self._cache[str(self)] = newrev
+                self._cache[self.cachekey] = newrev
             return self._finishupdate(newrev)
         else:
             raise Exception("update command returned non-zero result")
@@ -285,11 +313,23 @@ class RemoteVCSSupport(BaseVCSSupport):
 class CheckoutVCSSupport(BaseVCSSupport):
     """A base class for VCS implementations requiring a checkout."""
 
+    def __init__(self, *args, **kwargs):
+        BaseVCSSupport.__init__(self, *args, **kwargs)
+        # normalize once, so that all packages sharing the checkout
+        # (possibly via different paths) share the update
+        self._workdir = sys.intern(os.path.realpath(self.workdir))
+
+    @property
+    def cachekey(self):
+        """The canonical checkout directory."""
+        return self._workdir
+
     @abstractproperty
     def workdir(self):
-        """The absolute path to the checkout directory. The program
-        will enter that particular directory before executing
-        the update command or getting the checked out revision.
+        """The absolute path to the checkout directory. The update
+        command will be run in that particular directory. Note that
+        the current directory of the program is not changed,
+        so .currentrev needs to pass the path explicitly.
         """
         pass
 
@@ -299,35 +339,52 @@ class CheckoutVCSSupport(BaseVCSSupport):
         pass
 
     def _startupdate(self):
-        """Start the update command in the checkout directory."""
-        os.chdir(self.workdir)
-        BaseVCSSupport._startupdate(self)
+        """Start the update command in the checkout directory.
+        The revision is grabbed from the work tree afterwards, so STDOUT
+        is redirected to STDERR.
+        """
+        BaseVCSSupport._startupdate(
+            self, popenargs={"cwd": self._workdir, "stdout": sys.stderr}
+        )
 
     def parseoutput(self, output):
         """Fake parsing the output by grabbing revision from the work
         tree.
         """
-        os.chdir(self.workdir)
         return self.currentrev
 
-    def call(self, cmd, **kwargs):
+    def call(self, cmd, env={}):
         """A helper method for VCS classes. It executes the process
         passed as `cmd' (in the form of a list), grabs it output
         and returns it.
 
-        By default, STDERR is not captured (and thus is output to
-        screen), and the process is called with environment updated
-        from self.callenv. Additional keyword arguments will be
-        passed to subprocess.Popen().
+        STDERR is not captured (and thus is output to screen),
+        and the process is called with environment from self.callenv,
+        updated with `env'.
+
+        The process is started using os.posix_spawnp() rather than
+        subprocess.Popen() as the latter forks the whole (possibly
+        large) package manager process first.
         """
-        env = self.callenv.copy()
-        if "env" in kwargs:
-            env.update(kwargs["env"])
-        newkwargs = kwargs.copy()
-        newkwargs["env"] = env
-
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, **newkwargs)
-        ret = p.communicate()[0].decode(locale.getpreferredencoding(), "replace")
-        if p.wait() != 0:
+        callenv = self.callenv.copy()
+        callenv.update(env)
+
+        r, w = os.pipe2(os.O_CLOEXEC)
+        try:
+            pid = os.posix_spawnp(
+                cmd[0], cmd, callenv, file_actions=[(os.POSIX_SPAWN_DUP2, w, 1)]
+            )
+        except Exception:
+            os.close(r)
+            raise
+        finally:
+            os.close(w)
+
+        try:
+            with os.fdopen(r, "rb") as f:
+                ret = f.read().decode(locale.getpreferredencoding(), "replace")
+        finally:
+            status = os.waitpid(pid, 0)[1]
+        if os.waitstatus_to_exitcode(status) != 0:
             raise SystemError("Command failed: %s" % cmd)
         return ret
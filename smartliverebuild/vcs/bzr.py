@@ -2,6 +2,8 @@
 # (c) 2011 Michał Górny <mgorny@gentoo.org>
 # Released under the terms of the 2-clause BSD license.
 
+import shlex
+
 from . import RemoteVCSSupport, NonLiveEbuild
 
 
@@ -37,4 +39,4 @@ class BzrSupport(RemoteVCSSupport):
 
     @property
     def updatecmd(self):
-        return "%s %s" % (self.env["EBZR_REVNO_CMD"], self.env["EBZR_REPO_URI"])
+        return shlex.split(self.env["EBZR_REVNO_CMD"]) + [self.env["EBZR_REPO_URI"]]
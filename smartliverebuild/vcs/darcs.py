@@ -2,7 +2,7 @@
 # (c) 2011 Michał Górny <mgorny@gentoo.org>
 # Released under the terms of the 2-clause BSD license.
 
-import re
+import re, shlex
 
 from . import CheckoutVCSSupport
 
@@ -28,7 +28,7 @@ class DarcsSupport(CheckoutVCSSupport):
 
     @property
     def currentrev(self):
-        result = self.call(["darcs", "show", "repo"])
+        result = self.call(["darcs", "show", "repo", "--repodir", self.workdir])
         return int(re.search(r"Num Patches: ([0-9]+)", result).group(1))
 
     @property
@@ -38,9 +38,8 @@ class DarcsSupport(CheckoutVCSSupport):
 
     @property
     def updatecmd(self):
-        return "%s %s --all %s %s >&2" % (
-            self.env["EDARCS_DARCS_CMD"],
-            self.env["EDARCS_UPDATE_CMD"],
-            self.env["EDARCS_OPTIONS"],
-            self.env["EDARCS_REPOSITORY"],
+        return (
+            [self.env["EDARCS_DARCS_CMD"], self.env["EDARCS_UPDATE_CMD"], "--all"]
+            + shlex.split(self.env["EDARCS_OPTIONS"])
+            + [self.env["EDARCS_REPOSITORY"]]
         )
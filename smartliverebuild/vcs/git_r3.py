@@ -2,6 +2,8 @@
 # (c) 2011-2014 Michał Górny <mgorny@gentoo.org>
 # Released under the terms of the 2-clause BSD license.
 
+import shlex
+
 from . import RemoteVCSSupport, NonLiveEbuild, OtherEclass
 
 
@@ -36,9 +38,12 @@ class GitR3Support(RemoteVCSSupport):
 
     @property
     def updatecmd(self):
+        branch = self.env.get("EGIT_BRANCH") or "HEAD"
+        if len(self.repo_uris) == 1:
+            return ["git", "ls-remote", self.repo_uris[0], branch]
+
+        # fall back to the next URI on failure
         cmds = []
         for r in self.repo_uris:
-            cmds.append(
-                "git ls-remote %s %s" % (r, self.env.get("EGIT_BRANCH") or "HEAD")
-            )
+            cmds.append(shlex.join(["git", "ls-remote", r, branch]))
         return " || ".join(cmds)
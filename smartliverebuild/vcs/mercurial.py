@@ -31,8 +31,11 @@ class MercurialSupport(RemoteVCSSupport):
 
     @property
     def updatecmd(self):
-        return "hg identify --id --rev %s %s %s" % (
+        return [
+            "hg",
+            "identify",
+            "--id",
+            "--rev",
             self.env["EHG_REVISION"],
             self.env["EHG_REPO_URI"],
-            " ".join(self.trustopt),
-        )
+        ] + self.trustopt
@@ -46,14 +46,17 @@ class SubversionSupport(RemoteVCSSupport):
     @property
     def updatecmd(self):
         # XXX: branch?
-        user_pass = ""
-        if self.env["ESVN_USER"] and self.env["ESVN_PASSWORD"]:
-            user_pass = ' --username="%s" --password="%s" --no-auth-cache' % (
-                self.env["ESVN_USER"],
-                self.env["ESVN_PASSWORD"],
-            )
-        return "svn --config-dir %s/.subversion info %s%s" % (
-            self.env["ESVN_STORE_DIR"],
+        cmd = [
+            "svn",
+            "--config-dir",
+            "%s/.subversion" % self.env["ESVN_STORE_DIR"],
+            "info",
             self.env["ESVN_REPO_URI"],
-            user_pass,
-        )
+        ]
+        if self.env["ESVN_USER"] and self.env["ESVN_PASSWORD"]:
+            cmd += [
+                "--username=%s" % self.env["ESVN_USER"],
+                "--password=%s" % self.env["ESVN_PASSWORD"],
+                "--no-auth-cache",
+            ]
+        return cmd
@@ -2,8 +2,16 @@
 # (c) 2011 Michał Górny <mgorny@gentoo.org>
 # Released under the terms of the 2-clause BSD license.
 
+import pkgutil
+
+from . import vcs
 from .vcs import RemoteVCSSupport
 
+# eclass names for which a VCS module exists
+vcs_eclasses = frozenset(
+    m.name.replace("_", "-") for m in pkgutil.iter_modules(vcs.__path__)
+)
+
 
 class VCSLoader(object):
     vcs_cache = {}
@@ -11,6 +19,21 @@ class VCSLoader(object):
     def __init__(self, remote_only=False):
         self._remote_only = remote_only
 
+    def load_all(self, allowed=None):
+        """Load the classes for all supported VCS eclasses (or only
+        the `allowed' ones) and return a dict mapping eclass names
+        to them. Eclasses whose classes are not usable (e.g. due to
+        remote_only) are omitted.
+        """
+        ret = {}
+        for eclassname in vcs_eclasses:
+            if allowed and eclassname not in allowed:
+                continue
+            vcscl = self(eclassname, allowed)
+            if vcscl is not None:
+                ret[eclassname] = vcscl
+        return ret
+
     def __call__(self, eclassname, allowed=[]):
         if eclassname not in self.vcs_cache:
             self.vcs_cache[eclassname] = None